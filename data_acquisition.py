@@ -1,6 +1,8 @@
 import os
 import requests
 import zipfile
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
 
 
 dataset_folder_name = 'datasets'
@@ -8,8 +10,7 @@ dataset_folder_name = 'datasets'
 # retrieving my personal API key for datasets in developer.nrel
 # (required for Alternative Fuel Stations dataset)
 with open('api_key.txt') as f:
-    api_key = f.readlines()
-api_key = api_key[0]
+    api_key = f.readline().strip()
 
 dataset_links = {
     # 'nhtsa': 'https://www.nhtsa.gov/nhtsa-datasets-and-apis',
@@ -24,6 +25,35 @@ dataset_links = {
 }
 
 
+def fetch(session, source, url_link, filename):
+    '''
+    Download a dataset into the folder of its source, unzipping it if needed.
+    '''
+
+    # create directory for datasets from this source
+    if not os.path.exists(dataset_folder_name + '/' + source):
+        os.mkdir(dataset_folder_name + '/' + source)
+        print(f'Created subfolder for {source} data successfully')
+
+    # download data into source folder
+    # (streamed in chunks, so the whole file is never held in memory)
+    filepath = dataset_folder_name + '/' + source + '/' + filename
+    with session.get(url_link, stream=True, timeout=30) as response:
+        response.raise_for_status()
+        with open(filepath, "wb") as f:
+            for chunk in response.iter_content(chunk_size=16384):
+                f.write(chunk)
+    print('File downloaded successfully:', filename)
+
+    # if the file is zipped, unzip it
+    if filename.endswith('.zip'):
+        with zipfile.ZipFile(filepath, 'r') as zip_ref:
+            zip_ref.extractall(dataset_folder_name + '/' + source)
+
+        filename = filename[:-4]
+        print('File unzipped successfully:', filename)
+
+
 if __name__=='__main__':
 
     # create datasets folder
@@ -31,23 +61,15 @@ if __name__=='__main__':
         os.mkdir(dataset_folder_name)
         print('Created folder for data successfully')
 
-    for source, (url_link, filename) in dataset_links.items():
-
-        # create directory for datasets from this source
-        if not os.path.exists(dataset_folder_name + '/' + source):
-            os.mkdir(dataset_folder_name + '/' + source)
-            print(f'Created subfolder for {source} data successfully')
-        
-        # download data into source folder
-        filepath = dataset_folder_name + '/' + source + '/' + filename
-        response = requests.get(url_link)
-        open(filepath, "wb").write(response.content)
-        print('File downloaded successfully:', filename)
-
-        # if the file is zipped, unzip it
-        if filename.endswith('.zip'):
-            with zipfile.ZipFile(filepath, 'r') as zip_ref:
-                zip_ref.extractall(dataset_folder_name + '/' + source)
-
-            filename = filename[:-4]
-            print('File unzipped successfully:', filename)
+    # share a session between downloads, so connections are reused
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=4)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+
+    # download the datasets from all sources concurrently
+    with session, ThreadPoolExecutor(max_workers=len(dataset_links)) as executor:
+        list(executor.map(
+            lambda item: fetch(session, item[0], *item[1]),
+            dataset_links.items()
+        ))
@@ -1,25 +1,23 @@
 import pandas as pd
-import pyodbc
+import mssql_python
 
 
 if __name__=='__main__':
 
     # load the data
     example_dataset_path = 'datasets/epa/processed_alt_fuel_stations.csv'
-    df = pd.read_csv(example_dataset_path)
-
     # For simplicity I'll only show how to load the first 5 columns
-    # into a database in a SQL server
-    df = df.iloc[:, :5]
+    # into a database in a SQL server (so only those are parsed;
+    # the pyarrow engine needs them by name, so the header is read first)
+    header = pd.read_csv(example_dataset_path, nrows=0).columns
+    df = pd.read_csv(example_dataset_path, engine='pyarrow', usecols=list(header[:5]))
 
 
     # Connect to Cloud SQL Server
-    driver = 'Cloud SQL Server'
     server = 'local_host'
     database_name = 'bosch_db'
 
-    connection = pyodbc.connect(
-        f'Driver={driver};'
+    connection = mssql_python.connect(
         f'Server={server};'
         f'Database={database_name};'
         'Trusted_Connection=yes;'
@@ -41,15 +39,14 @@ if __name__=='__main__':
 
 
     # insert values into the table
-    insert_data_query = '''
-    INSERT INTO processed_alt_fuel_stations (id, EV_Level2_EVSE_Num, Latitude, Longitude, Open_Date)
-    VALUES (?,?,?,?,?)
-    '''
-    for row in df.itertuples():
-        cursor.execute(
-            insert_data_query,
-            row[0], row[1], row[2], row[3], row[4]
-        )
-    
+    # (bulk copy streams the rows through the TDS bulk load protocol,
+    # skipping the query parsing and parameter binding of an INSERT)
+    cursor.bulkcopy(
+        'processed_alt_fuel_stations',
+        df.itertuples(index=False, name=None),
+        batch_size=50000,
+        table_lock=True
+    )
+
     
     connection.commit()
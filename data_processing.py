@@ -1,31 +1,61 @@
+import inspect
+import numpy as np
 import pandas as pd
+from functools import partial
+from numba import njit, prange
 from scipy import stats
 
 
-def remove_duplicates(df):
+# EV features of the dep_energy dataset, missing for non-electric cars
+ev_cols_with_missing_data = [
+    'EV Network', 'EV Network Web', 'EV Connector Types'
+]
+
+
+def remove_duplicates(df, key_cols=None):
     '''
-    Remove repeated rows and a repeated column in the dep_energy dataset.
+    Remove repeated rows, comparing them on the key columns only, if given (e.g. a unique ID).
     '''
 
+    # if the ID is missing, compare the whole rows
+    if key_cols is not None and not set(key_cols).issubset(df.columns):
+        key_cols = None
+
     # remove duplicate rows
-    df = df.loc[~df.duplicated()]
+    df = df.drop_duplicates(subset=key_cols, ignore_index=True)
+
+    return df
+
+
+def fill_missing_ev_data(df):
+    '''
+    The dataset from the Dep. of Energy exhibits many missing entries in EV-related features,
+    due to the fact that those entries pertain to non-electric cars.
+    I fill those missing entries with 'Not applicable' or 0 (depending on the feature type).
+    '''
 
-    # remove repeated column
-    if 'Groups With Access Code (French)' in df.columns:
-        df = df.drop('Groups With Access Code (French)', axis=1)
+    mask_not_elec = df['Fuel Type Code']!='ELEC'
+
+    # fill with 'Not Applicable'
+    for col in ev_cols_with_missing_data:
+        df.loc[df[col].isna() & mask_not_elec, col] = 'Not Applicable'
+
+    # fill with zero values
+    df.loc[
+        df['EV Level2 EVSE Num'].isna() & mask_not_elec,
+        'EV Level2 EVSE Num'
+    ] = 0
 
     return df
 
 
-def deal_with_missing_data(df, source, verbose):
+def deal_with_missing_data(df, fill_missing_data=None, required_cols=None, verbose=False):
     '''
     Handle missing data:
     - remove features with over 50% missing data.
     - discard entries in features with less than 2% missing data.
-
-    The dataset from the Dep. of Energy exhibits many missing entries in EV-related features,
-    due to the fact that those entries pertain to non-electric cars.
-    I fill those missing entries with 'Not applicable' or 0 (depending on the feature type).
+    - fill missing data with a source-specific function, if given.
+    - discard entries still missing data in any of the required features.
     '''
 
     n_missing_data = df.isna().sum()
@@ -43,81 +73,66 @@ def deal_with_missing_data(df, source, verbose):
 
 
     # remove entries for features with little missing data
+    # (entries are only flagged here, and all flagged entries are discarded at once at the end)
     if verbose:
         print(
             'These columns have few missing values - dropped those entries:',
             list(perc_missing_data[perc_missing_data<2].index)
         )
-    for col in perc_missing_data[perc_missing_data<2].index:
-        df = df[~df[col].isna()]
+    low_missing_cols = perc_missing_data[perc_missing_data<2].index.tolist()
+    keep = df[low_missing_cols].notna().all(axis=1).to_numpy()
     perc_missing_data = perc_missing_data[perc_missing_data>=2]
 
 
-    # fill missing data in EV features
-    if source=='dep_energy':
-        
-        # fill with 'Not Applicable'
-        ev_cols_with_missing_data = [
-            'EV Network', 'EV Network Web', 'EV Connector Types'
-        ]
-        for col in ev_cols_with_missing_data:
-            df.loc[df[col].isna() & (df['Fuel Type Code']!='ELEC'), col] = 'Not Applicable'
-            df = df[~df[col].isna()]
+    # fill missing data (e.g. in EV features)
+    if fill_missing_data is not None:
+        df = fill_missing_data(df)
 
-        # fill with zero values
-        df.loc[
-            df['EV Level2 EVSE Num'].isna() & (df['Fuel Type Code']!='ELEC'),
-            'EV Level2 EVSE Num'
-        ] = 0
-        df = df[~df['EV Level2 EVSE Num'].isna()]
+    # flag the entries with missing data in required features
+    if required_cols is not None:
+        keep &= df[required_cols].notna().all(axis=1).to_numpy()
 
-    elif source=='epa':
-
-        df = df[~df['drive'].isna()]
+    df = df.loc[keep].copy()
 
     return df
 
 
-def fix_data_types(df, source, verbose):
+def fix_data_types_dep_energy(df):
     '''
-    Set date features to datetime type.
+    Set date features to datetime type, in the dep_energy dataset.
     '''
 
-    if source=='dep_energy':
+    df['Date Last Confirmed'] = pd.to_datetime(df['Date Last Confirmed'], format='%Y-%m-%d')
+    df['Open Date'] = pd.to_datetime(df['Open Date'], format='%Y-%m-%d', errors='coerce')
+    df['Updated At'] = pd.to_datetime(df['Updated At'])
 
-        df['Date Last Confirmed'] = pd.to_datetime(df['Date Last Confirmed'], format='%Y-%m-%d')
-        df['Open Date'] = pd.to_datetime(df['Open Date'], format='%Y-%m-%d', errors='coerce')
-        df['Updated At'] = pd.to_datetime(df['Updated At'])
+    df = df.loc[~df['Open Date'].isna()]
 
-        df = df.loc[~df['Open Date'].isna()]
-    
-    elif source=='epa':
+    return df
 
-        df['createdOn'] = pd.to_datetime(
-            df['createdOn'].str.replace('EST|EDT', '', regex=True)
-        ).dt.tz_localize('US/Eastern')
-        df['modifiedOn'] = pd.to_datetime(
-            df['modifiedOn'].str.replace('EST|EDT', '', regex=True)
-        ).dt.tz_localize('US/Eastern')
 
-    if verbose:
-        print('Date types fixed')
+def fix_data_types_epa(df):
+    '''
+    Set date features to datetime type, in the epa dataset.
+    '''
+
+    # dates have a fixed layout, e.g. 'Tue Jan 01 00:00:00 EST 2013',
+    # so the time zone (EST or EDT) is sliced out and a fixed format is parsed
+    for col in ['createdOn', 'modifiedOn']:
+        df[col] = pd.to_datetime(
+            df[col].str.slice_replace(20, 24, ''),
+            format='%a %b %d %H:%M:%S %Y', cache=True
+        ).dt.tz_localize('US/Eastern')
 
     return df
 
 
-def remove_unnecessary_columns(df, source):
+def remove_unnecessary_columns(df, cols):
     '''
     Remove some unnecessary columns.
     '''
 
-    if source=='dep_energy':
-        # a deprecated column, according to documentation
-        df = df.drop('Groups With Access Code', axis=1)
-
-    elif source=='epa':
-        # these columns had the same value for all entries
-        df = df.drop(['charge120', 'range', 'rangeCity', 'rangeHwy'], axis=1)
+    df = df.drop(cols, axis=1)
 
     return df
 
@@ -133,6 +148,25 @@ def fix_typos(df):
     return df
 
 
+@njit(parallel=True, cache=True)
+def flag_outliers(arr, lower_bounds, upper_bounds):
+    '''
+    Flag the rows with a value outside the bounds of its column,
+    in a single parallel pass over the array.
+    '''
+
+    n_rows, n_cols = arr.shape
+    outlier_flag = np.zeros(n_rows, dtype=np.bool_)
+
+    for i in prange(n_rows):
+        for j in range(n_cols):
+            if arr[i, j] < lower_bounds[j] or arr[i, j] > upper_bounds[j]:
+                outlier_flag[i] = True
+                break
+
+    return outlier_flag
+
+
 def remove_outliers(df):
     '''
     Remove outliers from the numerical features:
@@ -141,28 +175,71 @@ def remove_outliers(df):
     - if not, discard all values outside the interval [Q1 - 1.5*IQR, Q3 + 1.5*IQR].
     '''
 
-    for col in df.select_dtypes('float'):
+    float_cols = df.select_dtypes('float').columns
+    arr = df[float_cols].to_numpy(dtype=np.float64)
 
-        # test if the distribution is normal
-        mean = df[col].mean()
-        std = df[col].std()
-        norm_col = (df[col] - mean) / std
-        norm_test_results = stats.kstest(norm_col, stats.norm.cdf)
+    # test if the distribution of each column is normal
+    means = np.nanmean(arr, axis=0)
+    stds = np.nanstd(arr, axis=0, ddof=1)
+    norm_arr = (arr - means) / stds
+    is_normal = stats.kstest(norm_arr, 'norm', axis=0).pvalue > .05
 
-        # identify outliers with zscore for normal data
-        if norm_test_results.pvalue > .05:
-            outlier_flag = (df[col] < mean - 3*std) | (df[col] > mean + 3*std)
+    # bounds given by the zscore for normal data and by the IQR for non-normal data
+    q1, q3 = np.nanquantile(arr, [.25, .75], axis=0)
+    iqr = q3-q1
+    lower_bounds = np.where(is_normal, means - 3*stds, q1 - 1.5*iqr)
+    upper_bounds = np.where(is_normal, means + 3*stds, q3 + 1.5*iqr)
 
-        # identify outliers with IQR for non-normal data
-        else:
-            q1, q3 = df[col].quantile([.25, .75])
-            iqr = q3-q1
+    # discard every entry that is an outlier in any of the columns
+    outlier_flag = flag_outliers(arr, lower_bounds, upper_bounds)
+    df = df[~outlier_flag]
 
-            outlier_flag = (df[col] < q1-1.5*iqr) | (df[col] > q3 + 1.5*iqr)
+    return df
 
-        df = df[~outlier_flag]
 
-        return df
+# preprocessing steps for each dataset, specialised to that dataset,
+# each step together with the message to print after it
+# (steps with a verbose argument are also given the verbose flag)
+pipeline_per_source = {
+
+    'dep_energy': [
+        # entries are identified by a unique ID
+        (partial(remove_duplicates, key_cols=['ID']), 'Duplicates removed'),
+        # a repeated column
+        (
+            partial(remove_unnecessary_columns, cols=['Groups With Access Code (French)']),
+            'Repeated column removed'
+        ),
+        (
+            partial(
+                deal_with_missing_data,
+                fill_missing_data=fill_missing_ev_data,
+                required_cols=ev_cols_with_missing_data + ['EV Level2 EVSE Num']
+            ),
+            'Missing data handled'
+        ),
+        (fix_data_types_dep_energy, 'Date types fixed'),
+        # a deprecated column, according to documentation
+        (
+            partial(remove_unnecessary_columns, cols=['Groups With Access Code']),
+            'Unnecessary columns removed'
+        ),
+        (fix_typos, 'Typos fixed'),
+    ],
+
+    'epa': [
+        # entries are identified by a unique ID
+        (partial(remove_duplicates, key_cols=['id']), 'Duplicates removed'),
+        (partial(deal_with_missing_data, required_cols=['drive']), 'Missing data handled'),
+        (fix_data_types_epa, 'Date types fixed'),
+        # these columns had the same value for all entries
+        (
+            partial(remove_unnecessary_columns, cols=['charge120', 'range', 'rangeCity', 'rangeHwy']),
+            'Unnecessary columns removed'
+        ),
+        (remove_outliers, 'Outliers removed'),
+    ]
+}
 
 
 def process_data(dataset_path, verbose=True):
@@ -176,25 +253,25 @@ def process_data(dataset_path, verbose=True):
     - remove outliers
     '''
 
-    df = pd.read_csv(dataset_path)
-
     source = dataset_path.split('/')[-2]
 
     # if source is unknown, exit function with warning
-    if source not in ['dep_energy', 'epa']:
+    if source not in pipeline_per_source.keys():
         print('Unknown source')
-        return df
+        return pd.read_csv(dataset_path)
 
-    df = remove_duplicates(df)
-    df = deal_with_missing_data(df, source, verbose)
-    df = fix_data_types(df, source, verbose)
-    df = remove_unnecessary_columns(df, source)
+    # parse with the multi-threaded pyarrow engine
+    # (the whole file is read at once, since the missing data and outlier
+    # thresholds are computed over the whole dataset)
+    df = pd.read_csv(dataset_path, engine='pyarrow')
 
-    if source=='dep_energy':
-        df = fix_typos(df)
-
-    elif source=='epa':
-        df = remove_outliers(df)
+    for step, message in pipeline_per_source[source]:
+        if 'verbose' in inspect.signature(step).parameters:
+            df = step(df, verbose=verbose)
+        else:
+            df = step(df)
+        if verbose:
+            print(message)
 
     return df
 
@@ -1,5 +1,6 @@
+import numpy as np
 import pandas as pd
-import datetime
+from functools import partial
 
 # features per type for each dataset
 features_to_keep_per_source = {
@@ -69,29 +70,33 @@ def process_num_features(df, num_feats):
     Normalise numerical features.
     '''
 
+    # compute the statistics of all numerical features in a single pass
+    arr = df[num_feats].to_numpy(dtype=np.float64)
+    means = np.nanmean(arr, axis=0)
+    stds = np.nanstd(arr, axis=0, ddof=1)
+
     # discard numerical features with same value for all entries
-    if any(df[num_feats].std()==0):
-        num_feats = [feat for feat in num_feats if df[feat].std()!=0]
-        df = df.drop([feat for feat in num_feats if df[feat].std()==0], axis=1)
+    keep = stds!=0
+    df = df.drop([feat for feat, k in zip(num_feats, keep) if not k], axis=1)
+    num_feats = [feat for feat, k in zip(num_feats, keep) if k]
 
     # normalise
-    df[num_feats] = (df[num_feats] - df[num_feats].mean()) / df[num_feats].std()
+    df[num_feats] = (arr[:, keep] - means[keep]) / stds[keep]
 
     return df
 
 
-def process_date_features(df, date_feats, source):
+def process_date_features(df, date_feats, utc=False):
     '''
     Convert date columns into the number of days between those dates and now.
+    If utc, the dates are timezone-aware and are compared in UTC.
     '''
-    
+
+    current_timestamp = pd.Timestamp.now(tz='UTC') if utc else pd.Timestamp.now()
+
+    # (nullable integers, so that missing dates are kept as missing days)
     for col in date_feats:
-        
-        current_timestamp = (
-            datetime.datetime.now(datetime.timezone.utc) if source=='epa'
-            else datetime.datetime.now()
-        )
-        df[col] = (current_timestamp - df[col]).dt.days
+        df[col] = (current_timestamp - pd.to_datetime(df[col], utc=utc)).dt.days.astype('Int32')
 
     return df
 
@@ -103,110 +108,140 @@ def process_cat_features(df, cat_feats):
     Note: we drop one of the levels to prevent colinearity between features.
     '''
 
+    # count the levels (missing values being a level) and their entries
+    # with a single pass over each feature
+    binary_cols, multilevel_cols, smallest_levels = [], [], {}
     for col in cat_feats:
 
-        n_levels = len(df[col].unique())
+        codes, levels = pd.factorize(df[col])
+        n_levels = len(levels) + (codes==-1).any()
 
-        # for binary cat features, 1 represents the smallest category
         if n_levels==2:
-            level_counts = df[col].value_counts()
-            smallest_level = level_counts.index[-1]
-            df[col] = (df[col]==smallest_level).astype(int)
-
-        # one-hot encoding
+            binary_cols.append(col)
+            smallest_levels[col] = levels[np.bincount(codes[codes>=0]).argmin()]
         else:
-            df = pd.concat([
-                df.drop(col, axis=1),
-                pd.get_dummies(df[col], drop_first=True, prefix=col)
-            ], axis=1)
+            multilevel_cols.append(col)
 
-        # fix one class in the drive column
-        if col=='drive':
-            df['drive_4-Wheel Drive'] = df['drive_4-Wheel Drive'] + df['drive_4-Wheel or All-Wheel Drive']
-            df['drive_All-Wheel Drive'] = df['drive_All-Wheel Drive'] + df['drive_4-Wheel or All-Wheel Drive']
-            df = df.drop('drive_4-Wheel or All-Wheel Drive', axis=1)
+    # for binary cat features, 1 represents the smallest category
+    if binary_cols:
+        smallest_levels = pd.Series(smallest_levels)
+        df[binary_cols] = (df[binary_cols]==smallest_levels).astype('uint8')
+
+    # one-hot encoding, for all multi-level features at once
+    if multilevel_cols:
+        df = pd.get_dummies(df, columns=multilevel_cols, drop_first=True, dtype='uint8')
+
+    # fix one class in the drive column
+    if 'drive' in multilevel_cols:
+        df['drive_4-Wheel Drive'] = df['drive_4-Wheel Drive'] + df['drive_4-Wheel or All-Wheel Drive']
+        df['drive_All-Wheel Drive'] = df['drive_All-Wheel Drive'] + df['drive_4-Wheel or All-Wheel Drive']
+        df = df.drop('drive_4-Wheel or All-Wheel Drive', axis=1)
 
     return df
 
 
-def process_tag_features(df, tag_feats):
+def process_tag_features(df, tag_feats, sep=' '):
     '''
     For each tag feature, create new binary features - one for each unique tag of this tag feature -
     representing the rows where that tag is mentioned.
+    The tags are split on the regular expression sep.
     '''
 
     for tag_feat in tag_feats:
 
-        # splitting into tags depends on the tag feature
-        if tag_feat=='EV Connector Types':
-            list_tags_per_entry = df.loc[df[tag_feat] != 'Not Applicable', tag_feat].str.split(' ')
-
-        elif tag_feat=='fuelType':
-            list_tags_per_entry = df['fuelType'].str.split(' (and|or) ', regex=True)
-            list_tags_per_entry = list_tags_per_entry.apply(
-                lambda x: [item for item in x if item!='or' and item!='and']
-            )
+        list_tags_per_entry = df.loc[df[tag_feat] != 'Not Applicable', tag_feat].str.split(sep, regex=True)
 
-        unique_tags = set(item for sublist in list_tags_per_entry.to_list() for item in sublist)
+        # one row per (entry, tag) pair, with the tags encoded as column indices
+        tags = list_tags_per_entry.reset_index(drop=True).explode()
+        tag_idx, unique_tags = pd.factorize(tags, sort=True)
+        entry_idx = tags.index.to_numpy()[tag_idx >= 0]
+        tag_idx = tag_idx[tag_idx >= 0]
 
-        # create a dataframe with the new binary features
-        tag_new_cols = []
-        for tag in unique_tags:
-            tag_new_cols.append(
-                list_tags_per_entry.apply(lambda x: tag in x).rename(tag)
-            )
-        tag_new_cols = pd.concat(tag_new_cols, axis=1).astype(int)
+        # create a dataframe with the new binary features,
+        # filling a single pre-allocated matrix
+        tag_matrix = np.zeros((len(list_tags_per_entry), len(unique_tags)), dtype=np.uint8)
+        tag_matrix[entry_idx, tag_idx] = 1
+        tag_new_cols = pd.DataFrame(
+            tag_matrix, columns=unique_tags, index=list_tags_per_entry.index
+        )
 
         # merge with the original dataframe
         df = (df.drop(tag_feat, axis=1)).join(tag_new_cols)
-        df[list(unique_tags)] = df[list(unique_tags)].fillna(0)
+        df[list(unique_tags)] = df[list(unique_tags)].fillna(0).astype('uint8')
 
     return df
 
 
+def build_pipeline(feats_dict, utc_dates=False, tag_sep=' '):
+    '''
+    Specialise the processing steps to the features of a dataset,
+    returning each step together with the message to print after it.
+    '''
+
+    pipeline = []
+
+    if 'num_features_to_keep' in feats_dict.keys():
+        pipeline.append((
+            partial(process_num_features, num_feats=feats_dict['num_features_to_keep']),
+            'Numerical features processed'
+        ))
+
+    if 'date_features_to_keep' in feats_dict.keys():
+        pipeline.append((
+            partial(process_date_features, date_feats=feats_dict['date_features_to_keep'], utc=utc_dates),
+            'Date features processed'
+        ))
+
+    if 'cat_features_to_keep' in feats_dict.keys():
+        pipeline.append((
+            partial(process_cat_features, cat_feats=feats_dict['cat_features_to_keep']),
+            'Categorical features processed'
+        ))
+
+    if 'tag_features_to_keep' in feats_dict.keys():
+        pipeline.append((
+            partial(process_tag_features, tag_feats=feats_dict['tag_features_to_keep'], sep=tag_sep),
+            'Tag features processed'
+        ))
+
+    return pipeline
+
+
+# processing steps for each dataset
+pipeline_per_source = {
+
+    'dep_energy': build_pipeline(features_to_keep_per_source['dep_energy']),
+
+    # dates have UTC offsets, and tags may contain spaces (e.g. 'Regular Gas'),
+    # so they are split on the conjunctions only
+    'epa': build_pipeline(
+        features_to_keep_per_source['epa'], utc_dates=True, tag_sep=' (?:and|or) '
+    )
+}
+
+
 def transform_data(processed_dataset_path, source, verbose=True):
     '''
     Process each feature according to its type.
     '''
 
-    df = pd.read_csv(processed_dataset_path)
-
     # if source is neither dep_energy or epa, exit the function with warning
-    if source not in features_to_keep_per_source.keys():
+    if source not in pipeline_per_source.keys():
         print('Unknown source')
-        return df
-
-    if source=='dep_energy':
-        df['Open Date'] = pd.to_datetime(df['Open Date'])
-    elif source=='epa':
-        df['createdOn'] = pd.to_datetime(df['createdOn'])
-        df['modifiedOn'] = pd.to_datetime(df['modifiedOn'])
-    
+        return pd.read_csv(processed_dataset_path)
+
     feats_dict = features_to_keep_per_source[source]
     features_to_keep = [item for sublist in list(feats_dict.values()) for item in sublist]
 
-    # select only features listed in the dictionary above
+    # only parse the features listed in the dictionary above,
+    # ordering them as listed
+    df = pd.read_csv(processed_dataset_path, engine='pyarrow', usecols=features_to_keep)
     df = df.loc[:, features_to_keep]
 
-    if 'num_features_to_keep' in feats_dict.keys():
-        df = process_num_features(df, feats_dict['num_features_to_keep'])
-        if verbose:
-            print('Numerical features processed')
-    
-    if 'date_features_to_keep' in feats_dict.keys():
-        df = process_date_features(df, feats_dict['date_features_to_keep'], source)
-        if verbose:
-            print('Date features processed')
-
-    if 'cat_features_to_keep' in feats_dict.keys():
-        df = process_cat_features(df, feats_dict['cat_features_to_keep'])
-        if verbose:
-            print('Categorical features processed')
-
-    if 'tag_features_to_keep' in feats_dict.keys():
-        df = process_tag_features(df, feats_dict['tag_features_to_keep'])
+    for step, message in pipeline_per_source[source]:
+        df = step(df)
         if verbose:
-            print('Tag features processed')
+            print(message)
 
     return df
 